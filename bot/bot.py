@@ -7,6 +7,9 @@ import aiohttp
 import json
 import base64
 import asyncio
+import time
+import signal
+from collections import OrderedDict
 
 # Environment variables
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
@@ -16,6 +19,12 @@ LAVALINK_PASSWORD = os.getenv("LAVALINK_PASSWORD", "youshallnotpass")
 FALLBACK_VOICE_CHANNEL_ID = int(os.getenv("FALLBACK_VOICE_CHANNEL_ID", "0"))
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+WARMUP_INDEX_PATH = os.getenv("WARMUP_INDEX_PATH", "data/popular_tracks.json")
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "50"))
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "0.5"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "500"))
+SPOTIFY_CACHE_SIZE = int(os.getenv("SPOTIFY_CACHE_SIZE", "500"))
+INDEX_HALF_LIFE_DAYS = float(os.getenv("INDEX_HALF_LIFE_DAYS", "7"))
 
 # Discord bot setup
 intents = discord.Intents.none()
@@ -27,10 +36,54 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 
 URL_REGEX = re.compile(r"https?://\S+")
 
+SPOTIFY_TRACK_REGEX = re.compile(r'/track/([a-zA-Z0-9]+)')
+
 # Global variable for Spotify token
 spotify_token = None
 
+# Caches for resolved searches and Spotify lookups
+search_cache = OrderedDict()
+spotify_info_cache = OrderedDict()
+cache_stats = {"search_hits": 0, "search_misses": 0, "spotify_hits": 0, "spotify_misses": 0}
+
+# Usage index of requested queries, persisted so warm-up survives restarts.
+# Maps key -> [count, last_seen]; counts decay by half every INDEX_HALF_LIFE_DAYS.
+query_counts = {}
+INDEX_SAVE_INTERVAL = 60
+INDEX_MEMORY_SIZE = WARMUP_TOP_N * 100
+INDEX_DISK_SIZE = WARMUP_TOP_N * 10
+last_index_save = 0.0
+index_dirty = False
+index_save_task = None
+shutdown_task = None
+
+# Warm-up state; live searches in flight make warm-up back off
+warmup_task = None
+warmup_stats = {"running": False, "total": 0, "done": 0, "failed": 0, "started": None, "finished": None}
+live_searches = 0
+
 # Events
+@bot.event
+async def setup_hook():
+    """Load the usage index before any command can record a query."""
+    global index_save_task
+    
+    load_query_index()
+    index_save_task = asyncio.create_task(save_query_index_periodically())
+    
+    # docker stop sends SIGTERM; close cleanly so the index is saved on exit
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, request_shutdown)
+    except NotImplementedError:
+        pass
+
+def request_shutdown():
+    """Close the bot from a signal handler."""
+    global shutdown_task
+    
+    if shutdown_task is None:
+        shutdown_task = asyncio.create_task(bot.close())
+
 @bot.event
 async def on_ready():
     print(f"Bot ready as {bot.user} ({bot.user.id})")
@@ -82,6 +135,8 @@ async def setup_lavalink():
             for node in wavelink.Pool.nodes.values():
                 print(f"Node {node.identifier}: {node.status}")
         
+        start_warmup()
+        
     except Exception as e:
         print(f"Failed to connect to Lavalink: {e}")
         print("Bot will continue running, but music commands may not work")
@@ -124,14 +179,35 @@ async def get_spotify_access_token():
 
 async def get_spotify_track_info(spotify_url: str):
     """Extract track info from Spotify URL using official API."""
+    # Extract track ID from URL
+    track_id_match = SPOTIFY_TRACK_REGEX.search(spotify_url)
+    if not track_id_match:
+        return None
+    
+    track_id = track_id_match.group(1)
+    
+    if track_id in spotify_info_cache:
+        cache_stats["spotify_hits"] += 1
+        spotify_info_cache.move_to_end(track_id)
+        return spotify_info_cache[track_id]
+    cache_stats["spotify_misses"] += 1
+    
+    info = await fetch_spotify_track_info(track_id, spotify_url)
+    if info:
+        cache_spotify_info(track_id, info)
+    return info
+
+def cache_spotify_info(track_id: str, info: str):
+    """Store a resolved Spotify track, evicting the oldest entry."""
+    spotify_info_cache[track_id] = info
+    if len(spotify_info_cache) > SPOTIFY_CACHE_SIZE:
+        spotify_info_cache.popitem(last=False)
+
+async def fetch_spotify_track_info(track_id: str, spotify_url: str):
+    """Look up a Spotify track by ID, falling back to scraping."""
+    global spotify_token
+    
     try:
-        # Extract track ID from URL
-        track_id_match = re.search(r'/track/([a-zA-Z0-9]+)', spotify_url)
-        if not track_id_match:
-            return None
-        
-        track_id = track_id_match.group(1)
-        
         # Get access token if we don't have one
         if not spotify_token:
             await get_spotify_access_token()
@@ -179,7 +255,7 @@ async def get_spotify_track_info_fallback(spotify_url: str):
     """Fallback method using different scraping approach."""
     try:
         # Extract track ID from URL
-        track_id_match = re.search(r'/track/([a-zA-Z0-9]+)', spotify_url)
+        track_id_match = SPOTIFY_TRACK_REGEX.search(spotify_url)
         if not track_id_match:
             return None
         
@@ -244,6 +320,185 @@ async def get_spotify_track_info_fallback(spotify_url: str):
         print(f"Error in fallback method: {e}")
         return None
 
+def normalize_query(query: str) -> str:
+    """Normalize case and whitespace of text searches; URLs are kept as typed."""
+    query = query.strip()
+    if URL_REGEX.match(query):
+        # Video IDs in URLs are case-sensitive
+        return query
+    return " ".join(query.lower().split())
+
+def query_key(query: str) -> str:
+    """Normalize a !play query into a usage index key."""
+    if "open.spotify.com" in query:
+        track_id_match = SPOTIFY_TRACK_REGEX.search(query)
+        if track_id_match:
+            return f"spotify:{track_id_match.group(1)}"
+    return normalize_query(query)
+
+def load_query_index():
+    """Load the usage index of past queries from disk."""
+    global query_counts, last_index_save
+    
+    last_index_save = time.monotonic()
+    try:
+        with open(WARMUP_INDEX_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        now = time.time()
+        query_counts = {}
+        for key, value in data.get("queries", {}).items():
+            if isinstance(value, list):
+                query_counts[key] = [float(value[0]), float(value[1])]
+            else:
+                query_counts[key] = [float(value), now]
+        print(f"Loaded {len(query_counts)} queries from {WARMUP_INDEX_PATH}")
+    except FileNotFoundError:
+        query_counts = {}
+    except Exception as e:
+        print(f"Failed to load query index: {e}")
+        query_counts = {}
+
+def query_score(entry, now: float) -> float:
+    """Decay a [count, last_seen] index entry to the given time."""
+    count, last_seen = entry
+    return count * 0.5 ** ((now - last_seen) / (INDEX_HALF_LIFE_DAYS * 86400))
+
+def popular_queries(limit: int):
+    """Return the index entries with the highest decayed counts."""
+    now = time.time()
+    ranked = sorted(query_counts.items(), key=lambda item: (query_score(item[1], now), item[1][1]), reverse=True)
+    return ranked[:limit]
+
+def save_query_index():
+    """Write the usage index to disk, keeping only the most popular queries."""
+    global query_counts, last_index_save, index_dirty
+    
+    last_index_save = time.monotonic()
+    index_dirty = False
+    if len(query_counts) > INDEX_MEMORY_SIZE:
+        query_counts = dict(popular_queries(INDEX_MEMORY_SIZE))
+    try:
+        directory = os.path.dirname(WARMUP_INDEX_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{WARMUP_INDEX_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"queries": dict(popular_queries(INDEX_DISK_SIZE))}, f)
+        os.replace(tmp_path, WARMUP_INDEX_PATH)
+    except Exception as e:
+        print(f"Failed to save query index: {e}")
+
+async def save_query_index_periodically():
+    """Save the usage index in the background whenever it has changed."""
+    while True:
+        await asyncio.sleep(INDEX_SAVE_INTERVAL)
+        if index_dirty and time.monotonic() - last_index_save >= INDEX_SAVE_INTERVAL:
+            save_query_index()
+
+def record_query(query: str):
+    """Count a !play query towards the popular-track index."""
+    global index_dirty
+    
+    key = query_key(query)
+    if not key:
+        return
+    now = time.time()
+    entry = query_counts.get(key)
+    count = query_score(entry, now) if entry else 0.0
+    query_counts[key] = [count + 1, now]
+    index_dirty = True
+
+def cache_tracks(key: str, tracks):
+    """Store resolved tracks in the search cache, evicting the oldest entry."""
+    # Playlists change over time, so always fetch them fresh
+    if isinstance(tracks, wavelink.Playlist):
+        return
+    search_cache[key] = tracks
+    if len(search_cache) > SEARCH_CACHE_SIZE:
+        search_cache.popitem(last=False)
+
+async def search_tracks(query: str):
+    """Search Lavalink for a query, using the resolved-track cache."""
+    key = normalize_query(query)
+    if key in search_cache:
+        cache_stats["search_hits"] += 1
+        search_cache.move_to_end(key)
+        return search_cache[key]
+    cache_stats["search_misses"] += 1
+    
+    tracks = await wavelink.Playable.search(query)
+    if tracks:
+        cache_tracks(key, tracks)
+    return tracks
+
+def hit_rate(hits: int, misses: int) -> str:
+    """Format a cache hit rate as a percentage."""
+    total = hits + misses
+    if not total:
+        return "n/a"
+    return f"{hits / total:.0%} ({hits}/{total})"
+
+async def wait_for_live_searches():
+    """Wait until no !play search is in flight."""
+    while live_searches > 0:
+        await asyncio.sleep(WARMUP_DELAY)
+
+def start_warmup():
+    """Start the cache warm-up task unless one is already running."""
+    global warmup_task
+    
+    if warmup_task and not warmup_task.done():
+        return
+    warmup_task = asyncio.create_task(warmup_caches())
+
+async def warmup_caches():
+    """Pre-resolve the most requested queries at low priority.
+
+    Warm-up yields before each Spotify or Lavalink lookup, but a lookup
+    already in flight is not cancelled, so a !play arriving mid-lookup
+    still shares the node with it for that one request.
+    """
+    keys = [k for k, _ in popular_queries(WARMUP_TOP_N)]
+    
+    warmup_stats.update(running=True, total=len(keys), done=0, failed=0, started=time.monotonic(), finished=None)
+    print(f"Cache warm-up started: {len(keys)} queries")
+    
+    for key in keys:
+        try:
+            query = key
+            if key.startswith("spotify:"):
+                track_id = key.split(":", 1)[1]
+                query = spotify_info_cache.get(track_id)
+                if not query:
+                    # Let live commands go first
+                    await wait_for_live_searches()
+                    query = await fetch_spotify_track_info(track_id, f"https://open.spotify.com/track/{track_id}")
+                    if not query:
+                        raise ValueError("could not resolve Spotify track")
+                    cache_spotify_info(track_id, query)
+            
+            search_key = normalize_query(query)
+            if search_key not in search_cache:
+                await wait_for_live_searches()
+                tracks = await wavelink.Playable.search(query)
+                if not tracks:
+                    raise ValueError("no tracks found")
+                cache_tracks(search_key, tracks)
+        except Exception as e:
+            warmup_stats["failed"] += 1
+            print(f"Warm-up failed for {key}: {e}")
+        
+        warmup_stats["done"] += 1
+        if warmup_stats["done"] % 10 == 0:
+            print(f"Cache warm-up progress: {warmup_stats['done']}/{warmup_stats['total']}")
+        
+        await asyncio.sleep(WARMUP_DELAY)
+    
+    warmup_stats.update(running=False, finished=time.monotonic())
+    elapsed = warmup_stats["finished"] - warmup_stats["started"]
+    print(f"Cache warm-up finished: {warmup_stats['done'] - warmup_stats['failed']}/{warmup_stats['total']} "
+          f"resolved, {warmup_stats['failed']} failed in {elapsed:.1f}s")
+
 async def ensure_voice(ctx: commands.Context) -> wavelink.Player:
     """Join the author's voice channel or the fallback channel."""
     if ctx.voice_client and isinstance(ctx.voice_client, wavelink.Player):
@@ -275,6 +530,8 @@ async def check_lavalink_connection():
 @bot.command(name="play")
 async def play(ctx: commands.Context, *, query: str):
     """Play a track from YouTube or Spotify."""
+    global live_searches
+    
     try:
         # Check Lavalink connection first
         connected, status = await check_lavalink_connection()
@@ -282,26 +539,34 @@ async def play(ctx: commands.Context, *, query: str):
             return await ctx.send(f"❌ Lavalink not connected: {status}")
         
         player = await ensure_voice(ctx)
+        original_query = query
         
-        # Handle Spotify URLs
-        if "open.spotify.com" in query:
-            await ctx.send("🔍 Searching Spotify track on YouTube...")
-            spotify_info = await get_spotify_track_info(query)
-            if spotify_info:
-                query = spotify_info
-                await ctx.send(f"Found: **{spotify_info}**")
-            else:
-                return await ctx.send("❌ Could not extract track info from Spotify URL")
-        
-        # Search for tracks
+        live_searches += 1
         try:
-            tracks = await wavelink.Playable.search(query)
-        except Exception as e:
-            return await ctx.send(f"❌ Search failed: {str(e)}")
+            # Handle Spotify URLs
+            if "open.spotify.com" in query:
+                await ctx.send("🔍 Searching Spotify track on YouTube...")
+                spotify_info = await get_spotify_track_info(query)
+                if spotify_info:
+                    query = spotify_info
+                    await ctx.send(f"Found: **{spotify_info}**")
+                else:
+                    return await ctx.send("❌ Could not extract track info from Spotify URL")
+            
+            # Search for tracks
+            try:
+                tracks = await search_tracks(query)
+            except Exception as e:
+                return await ctx.send(f"❌ Search failed: {str(e)}")
+        finally:
+            live_searches -= 1
         
         if not tracks:
             return await ctx.send("❌ No tracks found")
         
+        # Only queries that resolve count towards the warm-up index
+        record_query(original_query)
+        
         # If it's a playlist, add all tracks
         if isinstance(tracks, wavelink.Playlist):
             added = 0
@@ -352,7 +617,11 @@ async def play(ctx: commands.Context, *, query: str):
                             # If all alternatives failed, try a more generic search
                             try:
                                 generic_query = f"{query} audio"
-                                generic_tracks = await wavelink.Playable.search(generic_query)
+                                live_searches += 1
+                                try:
+                                    generic_tracks = await wavelink.Playable.search(generic_query)
+                                finally:
+                                    live_searches -= 1
                                 if generic_tracks:
                                     await player.play(generic_tracks[0])
                                     await ctx.send(f"🎵 Playing alternative: **{generic_tracks[0].title}**")
@@ -543,8 +812,36 @@ async def debug(ctx: commands.Context):
     else:
         debug_info.append("**Player:** Not connected to voice")
     
+    debug_info.extend([
+        "",
+        f"**Search cache:** {hit_rate(cache_stats['search_hits'], cache_stats['search_misses'])}",
+        f"**Spotify cache:** {hit_rate(cache_stats['spotify_hits'], cache_stats['spotify_misses'])}",
+    ])
+    
     await ctx.send("\n".join(debug_info))
 
+@bot.command(name="warmup")
+async def warmup(ctx: commands.Context):
+    """Show cache warm-up progress and hit rates."""
+    if warmup_stats["started"] is None:
+        status = "Not started"
+    elif warmup_stats["running"]:
+        status = f"Running ({warmup_stats['done']}/{warmup_stats['total']})"
+    else:
+        elapsed = warmup_stats["finished"] - warmup_stats["started"]
+        status = f"Finished ({warmup_stats['done']}/{warmup_stats['total']}) in {elapsed:.1f}s"
+    
+    info = [
+        f"**Warm-up:** {status}",
+        f"Failed: {warmup_stats['failed']}",
+        f"Indexed queries: {len(query_counts)}",
+        f"Cached searches: {len(search_cache)}",
+        f"Cached Spotify tracks: {len(spotify_info_cache)}",
+        f"**Search cache:** {hit_rate(cache_stats['search_hits'], cache_stats['search_misses'])}",
+        f"**Spotify cache:** {hit_rate(cache_stats['spotify_hits'], cache_stats['spotify_misses'])}",
+    ]
+    await ctx.send("\n".join(info))
+
 @bot.command(name="test_lavalink")
 async def test_lavalink(ctx: commands.Context):
     """Test Lavalink connection."""
@@ -661,3 +958,5 @@ if __name__ == "__main__":
         print("Error: DISCORD_TOKEN environment variable not set")
     else:
         bot.run(DISCORD_TOKEN)
+        if index_dirty:
+            save_query_index()